@@ -1,16 +1,77 @@
 import argparse
+import functools
 import os
-import pickle
 import re
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from enum import Enum
 from bs4 import BeautifulSoup as BS
-from typing import List, Type, TypeVar
+from typing import List, Tuple, Type, TypeVar
 
-import requests
+import msgpack
+import orjson
+import requests_cache
+import zstandard as zstd
+from requests.adapters import HTTPAdapter
 
 BASE_URL = "http://www.sfu.ca/bin/wcm/course-outlines"
 TERM = ("2025", "registration")
+TIMEOUT = 10
+
+CCTX = zstd.ZstdCompressor(level=3)
+DCTX = zstd.ZstdDecompressor()
+
+SESSION = None
+SESSION_LOCK = threading.Lock()
+
+
+def get_session():
+    """
+    Creates the shared session on first use, so importing this module
+    doesn't create cache/http.sqlite.
+    """
+    global SESSION
+    with SESSION_LOCK:
+        if SESSION is None:
+            # outline responses are cached on disk so reruns mostly skip the network.
+            # seating pages are never cached since the seat counts need to be live.
+            session = requests_cache.CachedSession(
+                "cache/http",
+                backend="sqlite",
+                expire_after=3600,
+                urls_expire_after={"coursys.sfu.ca": requests_cache.DO_NOT_CACHE},
+            )
+            session.mount("http://", HTTPAdapter(pool_connections=32, pool_maxsize=32))
+            session.mount("https://", HTTPAdapter(pool_connections=32, pool_maxsize=32))
+            session.headers.update({"Accept-Encoding": "gzip"})
+            SESSION = session
+        return SESSION
+
+
+SEATING_RE = re.compile(r"(\d+)\s+out of\s+(\d+)(?:\s*\((\d+)\s+on waitlist\))?")
+SEATING_FIELD_RE = re.compile(r"(\d+) out of (\d+)(?: \((\d+) on waitlist\))?\s?\*?")
+COURSE_NUMBER_RE = re.compile(r"\d+")
+
+TAKEN = {
+    "cmpt": frozenset(
+        {
+            "105W",
+            "120",
+            "125",
+            "210",
+            "225",
+            "276",
+            "307",
+            "310",
+            "354",
+            "361",
+            "383",
+            "471",
+        }
+    ),
+    "psyc": frozenset({"100", "102"}),
+}
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--dept", required=True)
@@ -22,27 +83,34 @@ parser.add_argument("--seats", required=False)
 parser.add_argument("--waitlist", required=False)
 
 
+@functools.lru_cache(maxsize=1024)
 def get_seating(n, c):
     param = n[:-5].lower().replace(" ", "-")
     c = c.lower()
     if "00" in c:
         c = c[0:2]
     url = f"https://coursys.sfu.ca/browse/info/2025sp-{param}-{c}"
-    resp = requests.get(url)
+    resp = get_session().get(url, timeout=TIMEOUT)
     if not resp.ok:
         print(f"{url}: {resp.status_code}")
         sys.exit(-1)
 
-    soup = BS(resp.text, "html.parser")
-    field = soup.select_one(
-        "#courseinfo > tbody:nth-child(1) > tr:nth-child(3) > td:nth-child(2)"
-    )
-
-    assert field, "couldn't find seating field"
-    text = field.get_text(strip=True)
-    match = re.match(r"(\d+) out of (\d+)(?: \((\d+) on waitlist\))?\s?\*?", text)
+    # search only the courseinfo table's text rather than parsing the whole page
+    text = resp.text
+    start = text.find('id="courseinfo"')
+    match = None
+    if start != -1:
+        end = text.find("</table>", start)
+        match = SEATING_RE.search(text, start, end if end != -1 else len(text))
+    if not match:
+        soup = BS(resp.text, "html.parser")
+        field = soup.select_one(
+            "#courseinfo > tbody:nth-child(1) > tr:nth-child(3) > td:nth-child(2)"
+        )
 
-    match = re.match(r"(\d+) out of (\d+)(?: \((\d+) on waitlist\))?\s?\*?", text)
+        assert field, "couldn't find seating field"
+        text = field.get_text(strip=True)
+        match = SEATING_FIELD_RE.match(text)
 
     if match:
         # Extracted values
@@ -53,7 +121,7 @@ def get_seating(n, c):
         result = (students_in, total_students, waitlist)
         return result
     else:
-        print("couldn't match ", field)
+        print("couldn't match ", url)
         sys.exit()
 
 
@@ -74,6 +142,15 @@ def seat_str(n, c):
     return seating_to_str(*get_seating(n, c))
 
 
+DAYS = ("Mo", "Tu", "We", "Th", "Fr", "Sa", "Su")
+
+
+def days_to_mask(days: str | None) -> int:
+    if not days:
+        return 0
+    return sum(1 << i for i, day in enumerate(DAYS) if day in days)
+
+
 class D(Enum):
     M = "Mo"
     W = "We"
@@ -81,17 +158,26 @@ class D(Enum):
     TU = "Tu"
     TH = "Th"
 
+    def __init__(self, value) -> None:
+        self.mask = 1 << DAYS.index(value)
+
     def s(self):
         return self.value
 
 
 class Course:
+    __slots__ = ("id", "name")
+    required_keys = ("value", "title")
+
     def __init__(self, data) -> None:
         self.id = data["value"]
         self.name = data["title"]
 
 
 class Section:
+    __slots__ = ("id", "name", "type", "sec_code")
+    required_keys = ("value", "title", "classType", "sectionCode")
+
     def __init__(self, data) -> None:
         self.id = data["value"]
         self.name = data["title"]
@@ -100,12 +186,40 @@ class Section:
 
 
 class Schedule:
+    __slots__ = (
+        "campus",
+        "days",
+        "sectionCode",
+        "startTime",
+        "endTime",
+        "start_min",
+        "end_min",
+        "day_mask",
+    )
+
     def __init__(self, data) -> None:
         self.campus = data.get("campus", None)
         self.days = data.get("days", None)
         self.sectionCode = data.get("sectionCode", None)
         self.startTime = data.get("startTime", None)
         self.endTime = data.get("endTime", None)
+        self.day_mask = days_to_mask(self.days)
+        # parsed once here so constraint checks don't re-split the time strings
+        if self.startTime:
+            self.start_min = TimeConstraints.time_to_minutes(self.startTime)
+            self.end_min = TimeConstraints.time_to_minutes(self.endTime)
+        else:
+            self.start_min = None
+            self.end_min = None
+
+    def to_dict(self):
+        return {
+            "campus": self.campus,
+            "days": self.days,
+            "sectionCode": self.sectionCode,
+            "startTime": self.startTime,
+            "endTime": self.endTime,
+        }
 
     def __str__(self):
         return f"{self.days}: {self.startTime}-{self.endTime}"
@@ -114,6 +228,25 @@ class Schedule:
 
 
 class Outline:
+    __slots__ = (
+        "name",
+        "title",
+        "number",
+        "desc",
+        "section",
+        "type",
+        "outline_path",
+        "coreq",
+        "prereq",
+        "dept",
+        "level",
+        "details",
+        "schedule",
+        "s_in",
+        "s_out",
+        "s_wait",
+    )
+
     def __init__(self, data):
         info = data["info"]
         self.name = info.get("name")
@@ -137,8 +270,32 @@ class Outline:
         self.s_out = None
         self.s_wait = None
 
+    def to_dict(self):
+        return {
+            "info": {
+                "name": self.name,
+                "title": self.title,
+                "number": self.number,
+                "description": self.desc,
+                "section": self.section,
+                "type": self.type,
+                "outlinePath": self.outline_path,
+                "corequisites": self.coreq,
+                "prerequisites": self.prereq,
+                "dep": self.dept,
+                "degreeLevel": self.level,
+                "courseDetails": self.details,
+            },
+            "courseSchedule": [s.to_dict() for s in self.schedule] if self.schedule else None,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        # to_dict mirrors the outline API response, so the constructor rebuilds it
+        return cls(data)
+
     def set_seating(self):
-        s_in, s_out, s_wait = get_seating(c.name, c.section)
+        s_in, s_out, s_wait = get_seating(self.name, self.section)
         self.s_in = s_in
         self.s_out = s_out
         self.s_wait = s_wait
@@ -150,12 +307,6 @@ class Outline:
             s = f"[{seating_to_str(self.s_in, self.s_out, self.s_wait)}]"
             return s.ljust(24)
 
-    def print_prereq(self):
-        if self.prereq:
-            return print(f"\t\tPrereq: {self.prereq}")
-        else:
-            return print("\t\tPrereq: None")
-
     def __str__(self) -> str:
         return f"{self.seat_str()}\033[1;35m{self.name}\033[0m {self.title}" + "\n".ljust(17) + f"https://www.sfu.ca/outlines.html?{self.outline_path}" + "\n".ljust(21) + str(self.schedule)
 
@@ -166,29 +317,29 @@ T = TypeVar("T")
 
 
 def parse_to(data, clazz: Type[T]) -> List[T]:
-    parsed = []
-    for datum in data:
-        try:
-            parsed.append(clazz(datum))
-        except:
-            pass
-    return parsed
+    # malformed rows are skipped up front rather than raising
+    required = getattr(clazz, "required_keys", ())
+    return [
+        clazz(datum)
+        for datum in data
+        if isinstance(datum, dict) and all(k in datum for k in required)
+    ]
 
 
 def query(*params):
     url = BASE_URL + "?" + "/".join(params)
-    resp = requests.get(url)
+    resp = get_session().get(url, timeout=TIMEOUT)
     if not resp.ok:
         print(f"\033[31m{resp.status_code}:\033[0m {url}")
-    return resp.json()
+    return orjson.loads(resp.content)
 
 
 def load_cached_dept(dept):
-    cache_file = f"cache/{dept}.pkl"
+    cache_file = f"cache/{dept}.msgpack.zst"
     if os.path.exists(cache_file):
         with open(cache_file, "rb") as f:
             print(f"\033[32mFound cached data:\033[0m {cache_file}")
-            return pickle.load(f)
+            return [Outline.from_dict(o) for o in msgpack.unpackb(DCTX.decompress(f.read()), raw=False)]
     else:
         return None
 
@@ -196,21 +347,29 @@ def load_cached_dept(dept):
 def write_cached_dept(dept, data):
     if not os.path.exists("cache"):
         os.mkdir("cache")
-    cache_file = f"cache/{dept}.pkl"
+    cache_file = f"cache/{dept}.msgpack.zst"
     with open(cache_file, "wb") as f:
-        pickle.dump(data, f)
+        f.write(CCTX.compress(msgpack.packb([o.to_dict() for o in data], use_bin_type=True)))
         print(f"\033[K\033[1;32mWrote cache:\033[0m {cache_file}")
 
 
+def course_number(course: Course) -> int:
+    match = COURSE_NUMBER_RE.match(course.id)
+    return int(match.group()) if match else sys.maxsize
+
+
 def get_dept_data(dept):
     dept_data = load_cached_dept(dept)
     if dept_data is not None:
         return dept_data
     courses = parse_to(query(*TERM, dept), Course)
-    course_outlines = []
-    for i, course in enumerate(courses):
-        course: Course
-        print(f"\033[KLoading {dept}: {i}/{len(courses)}", end="\r")
+    # 8xx/9xx are graduate courses, so skip fetching their sections and outlines
+    courses = [course for course in courses if not course.id.startswith(("8", "9"))]
+    # lower numbers are more likely to be enrollable undergrad courses, so load them first
+    courses.sort(key=course_number)
+
+    # workers return their status line so only the main thread writes to stdout
+    def fetch(course: Course) -> Tuple[Outline | None, str]:
         try:
             course_id = course.id
             sections = parse_to(query(*TERM, dept, course_id), Section)
@@ -218,15 +377,23 @@ def get_dept_data(dept):
             section_id = section.id
             outline = Outline(query(*TERM, dept, course_id, section_id))
             if outline.level != "UGRD":
-                print(f"\033[K\033[1;33mFiltered:\033[0m {outline} (not ugrad)")
-
+                return None, f"\033[K\033[1;33mFiltered:\033[0m {outline} (not ugrad)"
             elif outline.type != "e":
-                print(f"\033[K\033[1;33mFiltered:\033[0m {outline} (not enrollable)")
+                return None, f"\033[K\033[1;33mFiltered:\033[0m {outline} (not enrollable)"
             else:
-                print(f"\033[K\033[1;32mLoaded:\033[0m {outline}")
-                course_outlines.append(outline)
+                return outline, f"\033[K\033[1;32mLoaded:\033[0m {outline}"
         except Exception as e:
-            print(f"\033[31mFailed. Skipping.\033[0m ({e})")
+            return None, f"\033[31mFailed. Skipping.\033[0m ({e})"
+
+    results: List[Outline | None] = [None] * len(courses)
+    with ThreadPoolExecutor(max_workers=16) as ex:
+        futures = {ex.submit(fetch, course): i for i, course in enumerate(courses)}
+        for done, future in enumerate(as_completed(futures), 1):
+            outline, status = future.result()
+            print(status)
+            print(f"\033[KLoading {dept}: {done}/{len(courses)}", end="\r")
+            results[futures[future]] = outline
+    course_outlines = [outline for outline in results if outline is not None]
     dept_data = course_outlines
     if dept_data:
         write_cached_dept(dept, dept_data)
@@ -261,7 +428,8 @@ class TimeConstraints:
         return TimeConstraints.Constraint(pos, day, start, end)
 
     def add_constraint(self, constraint: Constraint):
-        self.constraints.append(constraint)
+        self.constraints += (constraint,)
+        self._check.cache_clear()
         """
         if constraint.pos:
             self.pos_constraints.append(constraint)
@@ -270,7 +438,9 @@ class TimeConstraints:
         """
 
     def __init__(self, schedule_file: str | None, extra: str | None) -> None:
-        self.constraints = []
+        self.constraints = ()
+        # many schedules share the same meeting times, so cache results per instance
+        self._check = functools.lru_cache(maxsize=None)(self._check)
         if schedule_file:
             with open(schedule_file, "r") as schedule:
                 for constraint_str in schedule:
@@ -282,19 +452,22 @@ class TimeConstraints:
 
     @staticmethod
     def is_not_constrained(
-        days: str, start: int, end: int, constraint: Constraint
+        day_mask: int, start: int, end: int, constraint: Constraint
     ) -> bool:
-        if constraint.day.s() in days:
+        if constraint.day.mask & day_mask:
             time_conflict = start < constraint.end and end > constraint.start
             return constraint.pos == time_conflict
         return True
 
-    def satisfies_constraints(self, days: str, start: int, end: int) -> bool:
+    def _check(self, day_mask: int, start: int, end: int) -> bool:
         return all(
-            self.is_not_constrained(days, start, end, constraint)
+            self.is_not_constrained(day_mask, start, end, constraint)
             for constraint in self.constraints
         )
 
+    def satisfies_constraints(self, day_mask: int, start: int, end: int) -> bool:
+        return self._check(day_mask, start, end)
+
 
 if __name__ == "__main__":
     args = parser.parse_args()
@@ -302,69 +475,43 @@ if __name__ == "__main__":
     campus = args.campus
     day = args.day
 
-    def fu(data):
-        return [x for x in data if x.schedule]
+    constraints = TimeConstraints(args.schedule, args.extra)
 
-    def fc(data):
+    def campus_ok(course: Outline) -> bool:
         if campus == "any":
-            return [x for x in data if x.schedule[0].campus in ["Burnaby", "Surrey"]]
-        else:
-            return [x for x in data if x.schedule[0].campus == campus]
-
-    def ft(data, dept):
-        if dept == "cmpt":
-            taken = [
-                "105W",
-                "120",
-                "125",
-                "210",
-                "225",
-                "276",
-                "307",
-                "310",
-                "354",
-                "361",
-                "383",
-                "471",
-            ]
-            return [x for x in data if x.number not in taken]
-        if dept == "psyc":
-            taken = ["100", "102"]
-            return [x for x in data if x.number not in taken]
-        return data
-
-    def fd(data):
-        if not day:
-            return data
+            return course.schedule[0].campus in ["Burnaby", "Surrey"]
         else:
-            return [x for x in data if any([s for s in x.schedule if day in s.days])]
+            return course.schedule[0].campus == campus
 
-    def ftime(data):
-        def t2m(s):
-            s = s.split(":")
-            return 60 * int(s[0]) + int(s[1])
+    def day_ok(course: Outline) -> bool:
+        return not day or any(day in s.days for s in course.schedule)
 
-        def possible(course: Outline, constraints: TimeConstraints):
-            assert course.schedule
-            for s in course.schedule:
-                # not all schedules have times. idk why
-                if s.startTime:
-                    start = t2m(s.startTime)
-                    end = t2m(s.endTime)
-                    if not constraints.satisfies_constraints(s.days, start, end):
-                        return False
-            return True
-
-
-        constraints = TimeConstraints(args.schedule, args.extra)
-        return [x for x in data if possible(x, constraints)]
+    def time_ok(course: Outline) -> bool:
+        for s in course.schedule:
+            # not all schedules have times. idk why
+            if s.start_min is not None:
+                if not constraints.satisfies_constraints(s.day_mask, s.start_min, s.end_min):
+                    return False
+        return True
 
     for dept in depts:
         data = get_dept_data(dept)
-        courses = ftime(ft(fd(fc(fu(data))), dept))
+        taken = TAKEN.get(dept, ())
+        # cheapest checks first, so most courses are rejected before walking schedules
+        courses = [
+            x
+            for x in data
+            if x.schedule
+            and campus_ok(x)
+            and x.number not in taken
+            and day_ok(x)
+            and time_ok(x)
+        ]
+        with ThreadPoolExecutor(max_workers=16) as ex:
+            list(ex.map(lambda c: c.set_seating(), courses))
+        chunks = []
         for c in courses:
             c: Outline
-            c.set_seating()
             if (not args.seats or c.s_out - c.s_in >= int(args.seats)) and (not args.waitlist or c.s_wait <= int(args.waitlist)):
-                print(c)
-                c.print_prereq()
+                chunks.append(f"{c}\n\t\tPrereq: {c.prereq or 'None'}\n")
+        sys.stdout.write("".join(chunks))